@@ -1,339 +1,560 @@
-from flask import Flask, request, jsonify
-import os
-import tempfile
-import cv2 # OpenCV for image preprocessing
-import pytesseract
-from PIL import Image # Pillow for image handling
-import re
-import json
-
-# --- Tesseract Configuration (IMPORTANT!) ---
-# If Tesseract is not in your system's PATH, you need to specify the location of the tesseract.exe executable.
-# For WSL/Linux, it's usually '/usr/bin/tesseract'.
-# For Windows, it could be something like r'C:\Program Files\Tesseract-OCR\tesseract.exe'.
-# Also ensure TESSDATA_PREFIX is set if language files are not found automatically.
-
-# Example for WSL/Linux:
-# pytesseract.pytesseract.tesseract_cmd = r'/usr/bin/tesseract'
-# os.environ['TESSDATA_PREFIX'] = '/usr/share/tesseract-ocr/5/' # Adjust to your tessdata location
-
-app = Flask(__name__)
-
-# Dictionary for normalizing commonly misdetected OCR values
-NORMALIZATION_MAPS = {
-    "agama": {
-        "BA": "ISLAM",
-        "BUDHA": "BUDHA",
-        "HINDU": "HINDU",
-        "ISLAM": "ISLAM",
-        "KATOLIK": "KATOLIK",
-        "KONGHUCU": "KONGHUCU",
-        "KRISTEN": "KRISTEN"
-    },
-    "jenis_kelamin": {
-        "LAKI-LAKI": "LAKI-LAKI",
-        "LAKH MU": "LAKI-LAKI", # Typo example
-        "LAKI": "LAKI-LAKI",
-        "PEREMPUAN": "PEREMPUAN",
-        "PEREM PUAN": "PEREMPUAN"
-    },
-    "status_perkawinan": {
-        "KAWIN": "KAWIN",
-        "YAWN A": "KAWIN", # Typo example
-        "BELUM KAWIN": "BELUM KAWIN",
-        "CERAI HIDUP": "CERAI HIDUP",
-        "CERAI MATI": "CERAI MATI"
-    },
-    "kewarganegaraan": {
-        "WNI": "WNI",
-        "WN": "WNI", # Abbreviation or typo
-        "WNA": "WNA"
-    },
-    "pekerjaan": {
-        "MENGURUS RUMAH TANGGA": "MENGURUS RUMAH TANGGA",
-        "MENGUMUS RUMAH TANGGA": "MENGURUS RUMAH TANGGA", # Typo example
-        "KARYAWAN SWASTA": "KARYAWAN SWASTA",
-        "KARYAWAN": "KARYAWAN SWASTA",
-        "PELAJAR/MAHASISWA": "PELAJAR/MAHASISWA",
-        "TNI": "TNI",
-        "POLRI": "POLRI",
-        "PNS": "PNS",
-        "WIRASWASTA": "WIRASWASTA",
-        # Add more job variations if needed
-    },
-    "berlaku_hingga": {
-        "SEUMUR HIDUP": "SEUMUR HIDUP",
-        "UMUR HIDUP": "SEUMUR HIDUP", # Typo example
-        "SF UMUR HIDUP": "SEUMUR HIDUP", # Typo example
-        "BARTAU HINGGA": "SEUMUR HIDUP" # Typo example
-    }
-}
-
-def normalize_value(field, value):
-    """Normalizes extracted values based on a dictionary."""
-    if value is None:
-        return None
-    
-    # Pre-clean value before normalization lookup
-    value = value.upper().strip()
-    value = re.sub(r'[^A-Z0-9\s/.,-]', '', value) # Remove common non-alphanumeric characters
-
-    if field in NORMALIZATION_MAPS:
-        for key, norm_val in NORMALIZATION_MAPS[field].items():
-            if key in value: # Check substring
-                return norm_val
-    
-    return value.strip() # Return stripped and uppercased value if not in map
-
-def extract_ktp_data(image_path, lang='ind'):
-    """
-    Performs OCR on a KTP image, extracts key data using improved regex,
-    and returns it as a dictionary.
-    """
-    if not os.path.exists(image_path):
-        return {"error": f"Image not found at '{image_path}'"}
-
-    img = cv2.imread(image_path)
-    if img is None:
-        return {"error": f"Could not load image from '{image_path}'. Ensure it's a valid image format."}
-
-    # --- Image Preprocessing for Better OCR Results ---
-    # Convert to grayscale
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    # Apply Gaussian blur to reduce noise
-    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-    # Binarization using Otsu's method
-    _, thresh = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    # Convert back to PIL Image format for Tesseract
-    pil_img = Image.fromarray(thresh)
-
-    # Perform OCR
-    try:
-        # Use PSM 6 (Assume a single uniform block of text) or try other PSMs (e.g., 11 for sparse text)
-        raw_text = pytesseract.image_to_string(pil_img, lang=lang, config='--psm 6 --oem 3')
-    except pytesseract.TesseractNotFoundError:
-        return {"error": "Tesseract OCR engine not found. Ensure it's installed and its path is correct."}
-    except Exception as e:
-        return {"error": f"An error occurred during OCR: {e}"}
-
-    # --- Data Extraction from Raw Text (Improved Logic) ---
-    # Initialize with None for all fields
-    extracted_data = {
-        "NIK": None,
-        "Nama": None,
-        "Tempat_Lahir": None,
-        "Tanggal_Lahir": None,
-        "Jenis_Kelamin": None,
-        "Alamat": None,
-        "RT_RW": None,
-        "Kel_Desa": None,
-        "Kecamatan": None,
-        "Agama": None,
-        "Status_Perkawinan": None,
-        "Pekerjaan": None,
-        "Kewarganegaraan": None,
-        "Berlaku_Hingga": None,
-        "raw_ocr_text": raw_text
-    }
-
-    # Split text into lines and normalize each line
-    lines = [line.strip().upper() for line in raw_text.split('\n') if line.strip()]
-    full_text_normalized = " ".join(lines) # Normalized full text for global regex
-
-    # --- NIK ---
-    # Search for NIK with more flexible patterns, including common typos
-    # Allow non-digit characters between digits, then clean them
-    nik_match = re.search(r'NIK\s*[: ]*\s*([0-9OIEZSLGAQ\s]{16,})', full_text_normalized)
-    if nik_match:
-        nik_raw_candidate = nik_match.group(1)
-        # Cleaning NIK: replace common OCR errors
-        cleaned_nik = (
-            nik_raw_candidate.replace('O', '0').replace('I', '1').replace('L', '1')
-            .replace('Z', '2').replace('S', '5').replace('G', '6').replace('Q', '9')
-            .replace('A', '4').replace(' ', '') # Remove spaces
-        )
-        # Take only the first 16 digits
-        cleaned_nik = ''.join(filter(str.isdigit, cleaned_nik))[:16]
-        if len(cleaned_nik) == 16:
-            extracted_data['NIK'] = cleaned_nik
-
-    # --- Iterate per line for extraction ---
-    for i, line in enumerate(lines):
-        # Nama
-        # Search for "NAMA", "NAMA LENGKAP", "TAMA" (common typo) followed by optional colon/space and then capture the value.
-        name_label_match = re.search(r'(NAMA(?:\s*LENGKAP)?|TAMA)\s*[: ]*\s*(.*)', line)
-        if name_label_match and extracted_data['Nama'] is None:
-            name_value = name_label_match.group(2).strip() # Capture everything after the label and optional colon/space
-            if name_value:
-                # Clean the extracted name value
-                extracted_data['Nama'] = re.sub(r'[^A-Z\s\.]', '', name_value).strip()
-            continue
-        # Fallback: If the label is found but the value is on the next line (e.g., "NAMA:\nJOHN DOE")
-        elif (re.search(r'NAMA(?:\s*LENGKAP)?\s*[: ]*$', line) or ("TAMA" in line.strip() and line.strip().endswith(':'))) and extracted_data['Nama'] is None:
-            if i + 1 < len(lines):
-                name_value = lines[i+1].strip()
-                if name_value:
-                    extracted_data['Nama'] = re.sub(r'[^A-Z\s\.]', '', name_value).strip()
-            continue
-
-        # Place/Date of Birth
-        # More flexible for labels and date formats
-        ttl_match = re.search(r'(?:TEMPAT/?TGL LAHIR|TEMPAT DAN TGL LAHIR|TEMPAT *TGL LAHIR|TEMPAT/IY AR)\s*[: ]*([A-Z\s]+)[, ]*(\d{2}[-/]\d{2}[-/]\d{4})', line)
-        if ttl_match:
-            extracted_data['Tempat_Lahir'] = ttl_match.group(1).strip()
-            extracted_data['Tanggal_Lahir'] = ttl_match.group(2).replace('/', '-').strip()
-            continue
-        elif extracted_data['Tempat_Lahir'] is None: # If not detected yet, try separate patterns
-             tempat_match = re.search(r'(?:TEMPAT/?TGL LAHIR|TEMPAT LAHIR|TEMPAT/IY AR)\s*[: ]*([A-Z\s]+?)(?:,|$)', line)
-             if tempat_match:
-                 extracted_data['Tempat_Lahir'] = tempat_match.group(1).strip()
-             tanggal_match = re.search(r'(\d{2}[-/]\d{2}[-/]\d{4})', line)
-             if tanggal_match:
-                 extracted_data['Tanggal_Lahir'] = tanggal_match.group(1).replace('/', '-').strip()
-
-
-        # Gender
-        jk_match = re.search(r'(?:JENIS KELAMIN|JARAN KETAUAN)\s*[: ]*(LAKI-LAKI|PEREMPUAN|LAKI|PEREMPUAN)', line) # 'LAKI'/'PEREMPUAN' without strip
-        if jk_match:
-            extracted_data['Jenis_Kelamin'] = normalize_value("jenis_kelamin", jk_match.group(1))
-            continue
-
-        # --- Address, RT/RW, Kel/Desa, Kecamatan (Multi-line) ---
-        if "ALAMAT" in line:
-            alamat_lines_buffer = []
-            start_collecting = False
-            # Collect lines starting from the "ALAMAT" line
-            for j in range(i, len(lines)):
-                current_sub_line = lines[j]
-                if "ALAMAT" in current_sub_line and not start_collecting:
-                    start_collecting = True
-                    val = current_sub_line.split('ALAMAT', 1)[-1].strip()
-                    if val.startswith(':'): val = val[1:].strip()
-                    if val: alamat_lines_buffer.append(val)
-                elif start_collecting:
-                    # Stop if next major KTP field is detected
-                    if any(keyword in current_sub_line for keyword in ["AGAMA", "STATUS PERKAWINAN", "PEKERJAAN", "KEWARGANEGARAAN", "BERLAKU HINGGA", "JENIS KELAMIN", "TEMPAT/TGL LAHIR", "NIK", "NAMA"]):
-                        break
-                    alamat_lines_buffer.append(current_sub_line)
-            
-            full_address_block = " ".join(alamat_lines_buffer).strip()
-            
-            # --- Extract RT/RW from the full address block first ---
-            rt_rw_match = re.search(r'(?:RT|R\.T|AT)\s*[: ]*(\d{2,3})\s*(?:RW|R\.W|AW)\s*[: ]*(\d{2,3})', full_address_block, re.IGNORECASE)
-            if rt_rw_match:
-                extracted_data['RT_RW'] = f"{rt_rw_match.group(1)}/{rt_rw_match.group(2)}"
-                # Remove RT/RW part from the address for cleaner alamat field
-                full_address_block = re.sub(re.escape(rt_rw_match.group(0)), '', full_address_block, flags=re.IGNORECASE).strip()
-            else: # Try simple XX/YYY format anywhere
-                simple_rt_rw_match = re.search(r'(\d{2,3}/\d{2,3})', full_address_block)
-                if simple_rt_rw_match:
-                    extracted_data['RT_RW'] = simple_rt_rw_match.group(1)
-                    full_address_block = re.sub(re.escape(simple_rt_rw_match.group(0)), '', full_address_block, flags=re.IGNORECASE).strip()
-
-            # --- Extract Kel/Desa ---
-            kel_desa_match = re.search(r'(?:KEL/DESA|KELDASA|KAUS)\s*[: ]*([A-Z\s\.]+)', full_address_block)
-            if kel_desa_match:
-                extracted_data['Kel_Desa'] = kel_desa_match.group(1).strip()
-                full_address_block = re.sub(re.escape(kel_desa_match.group(0)), '', full_address_block, flags=re.IGNORECASE).strip()
-
-            # --- Extract Kecamatan ---
-            kecamatan_match = re.search(r'(?:KECAMATAN|KEAMATAN)\s*[: ]*([A-Z\s\.]+)', full_address_block)
-            if kecamatan_match:
-                extracted_data['Kecamatan'] = kecamatan_match.group(1).strip()
-                full_address_block = re.sub(re.escape(kecamatan_match.group(0)), '', full_address_block, flags=re.IGNORECASE).strip()
-
-            # The remaining text in full_address_block should be the main street address
-            extracted_data['Alamat'] = re.sub(r'^\s*[:\s]*', '', full_address_block).strip() # Remove colon or spaces at the beginning
-
-            continue # Important to avoid double-processing the same line
-
-        # Religion
-        if "AGAMA" in line:
-            agama_match = re.search(r'AGAMA\s*[: ]*([A-Z\s]+)', line)
-            if agama_match:
-                extracted_data['Agama'] = normalize_value("agama", agama_match.group(1))
-            continue
-
-        # Marital Status
-        if "STATUS PERKAWINAN" in line or "SINTA PERKAMNAN" in line:
-            status_match = re.search(r'(?:STATUS PERKAWINAN|SINTA PERKAMNAN)\s*[: ]*([A-Z\s]+)', line)
-            if status_match:
-                extracted_data['Status_Perkawinan'] = normalize_value("status_perkawinan", status_match.group(1))
-            continue
-
-        # Occupation
-        if "PEKERJAAN" in line or "REHENAAAN" in line:
-            # Search for "Pekerjaan" keyword or its typo, then get the rest of the line
-            # More flexible to include "MENGURUS RUMAH TANGGA" or "KARYAWAN SWASTA"
-            pekerjaan_match = re.search(r'(?:PEKERJAAN|REHENAAAN)\s*[: ]*([A-Z\s\.]+)', line)
-            if pekerjaan_match:
-                extracted_data['Pekerjaan'] = normalize_value("pekerjaan", pekerjaan_match.group(1))
-            continue
-
-        # Nationality
-        if "KEWARGANEGARAAN" in line or "#EERGANEYER" in line:
-            kewarganegaraan_match = re.search(r'(?:KEWARGANEGARAAN|#EERGANEYER)\s*[: ]*([A-Z]+)', line)
-            if kewarganegaraan_match:
-                extracted_data['Kewarganegaraan'] = normalize_value("kewarganegaraan", kewarganegaraan_match.group(1))
-            continue
-
-        # Valid Until
-        if "BERLAKU HINGGA" in line or "BARTAU HINGGA" in line:
-            berlaku_match = re.search(r'(?:BERLAKU HINGGA|BARTAU HINGGA)\s*[: ]*(SEUMUR HIDUP|\d{2}[-/]\d{2}[-/]\d{4})', line, re.IGNORECASE)
-            if berlaku_match:
-                extracted_data['Berlaku_Hingga'] = normalize_value("berlaku_hingga", berlaku_match.group(1))
-                if extracted_data['Berlaku_Hingga'] is not None and re.match(r'\d{2}[-/]\d{2}[-/]\d{4}', extracted_data['Berlaku_Hingga']):
-                    extracted_data['Berlaku_Hingga'] = extracted_data['Berlaku_Hingga'].replace('/', '-')
-            continue
-            
-    # --- Return the extracted_data dictionary as populated, without explicit reordering ---
-    return extracted_data
-
-@app.route('/ocr/ktp', methods=['POST'])
-def ocr_ktp():
-    """
-    API endpoint to upload a KTP image and get extracted data.
-    """
-    if 'file' not in request.files:
-        return jsonify({"error": "No 'file' part in the request."}), 400
-
-    file = request.files['file']
-
-    if file.filename == '':
-        return jsonify({"error": "No file selected."}), 400
-
-    if file:
-        temp_path = None # Initialize temp_path outside try block
-        try:
-            # Save the file temporarily for processing
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp_file:
-                file.save(tmp_file.name)
-                temp_path = tmp_file.name
-            
-            # Call the KTP data extraction function
-            extracted_data = extract_ktp_data(temp_path, lang='ind')
-            
-            # Check for errors from the data extraction function
-            if "error" in extracted_data and extracted_data["error"]:
-                return jsonify(extracted_data), 500
-            
-            return jsonify(extracted_data), 200
-        except Exception as e:
-            # Handle unexpected errors during the process
-            return jsonify({"error": f"Internal server error: {str(e)}"}), 500
-        finally:
-            # Ensure the temporary file is deleted
-            if temp_path and os.path.exists(temp_path):
-                os.remove(temp_path)
-    return jsonify({"error": "Unknown error."}), 500
-
-@app.route('/')
-def home():
-    """
-    Simple home page to check if the API is running.
-    """
-    return "KTP OCR API is running. Send a POST request to /ocr/ktp with a 'file' parameter containing the KTP image."
-
-if __name__ == '__main__':
-    # Run the Flask application.
-    app.run(debug=True, host='0.0.0.0', port=5000)
+import os
+
+# Keep Tesseract's OpenMP single-threaded: its thread coordination is wasteful and
+# fights with other workers for cores. Scale horizontally with multiple processes
+# instead (e.g. `gunicorn -w N app:app`). Must be set before Tesseract is loaded.
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+from flask import Flask, request, jsonify
+import threading
+import queue
+import hashlib
+import itertools
+from collections import OrderedDict
+import cv2 # OpenCV for image preprocessing
+import numpy as np
+import pytesseract
+import re
+import json
+
+# Optional in-process Tesseract API (pip install tesserocr). pytesseract forks a
+# tesseract binary and reloads the language data on every call (~200ms fixed cost
+# per request); tesserocr keeps one initialized engine in the worker process.
+# Falls back to pytesseract when tesserocr is not installed.
+try:
+    import tesserocr
+    from tesserocr import OEM, PSM
+except ImportError:
+    tesserocr = None
+
+# Disable OpenCV's internal threading for the same reason: per-request latency is
+# dominated by OCR, and per-worker parallelism only adds contention under load.
+cv2.setNumThreads(0)
+
+# --- Tesseract Configuration (IMPORTANT!) ---
+# If Tesseract is not in your system's PATH, you need to specify the location of the tesseract.exe executable.
+# For WSL/Linux, it's usually '/usr/bin/tesseract'.
+# For Windows, it could be something like r'C:\Program Files\Tesseract-OCR\tesseract.exe'.
+# Also ensure TESSDATA_PREFIX is set if language files are not found automatically.
+
+# Example for WSL/Linux:
+# pytesseract.pytesseract.tesseract_cmd = r'/usr/bin/tesseract'
+# os.environ['TESSDATA_PREFIX'] = '/usr/share/tesseract-ocr/5/' # Adjust to your tessdata location
+
+app = Flask(__name__)
+
+# Maximum long-edge size (in pixels) an uploaded image is scaled down to before OCR
+KTP_MAX_DIM = int(os.environ.get('KTP_MAX_DIM', '1600'))
+
+# Adaptive-threshold tuning: neighbourhood size (odd) and constant subtracted
+# from the local mean
+KTP_ADAPTIVE_BLOCK = int(os.environ.get('KTP_ADAPTIVE_BLOCK', '31'))
+KTP_ADAPTIVE_C = int(os.environ.get('KTP_ADAPTIVE_C', '10'))
+
+# Tesseract tuning, overridable per deployment. PSM 11 (sparse text) suits the
+# KTP's scattered labeled fields better than PSM 6 and skips the layout analysis
+# a uniform-block assumption triggers; OEM 1 is LSTM-only.
+KTP_TESS_CONFIG = os.environ.get('KTP_TESS_CONFIG', '--psm 11 --oem 1')
+
+def _tess_config_int(flag, default):
+    """Pulls an integer flag value (e.g. --psm) out of KTP_TESS_CONFIG."""
+    m = re.search(r'--%s\s+(\d+)' % flag, KTP_TESS_CONFIG)
+    return int(m.group(1)) if m else default
+
+# Number of preinitialized Tesseract engines per language; size this to the
+# server's thread count (e.g. gunicorn --threads N) so concurrent requests don't
+# serialize on a single engine
+KTP_TESS_POOL = int(os.environ.get('KTP_TESS_POOL', '2'))
+
+# LRU cache of extraction results keyed by (sha256 of file bytes, language)
+KTP_CACHE_SIZE = int(os.environ.get('KTP_CACHE_SIZE', '1024'))
+_OCR_CACHE = OrderedDict()
+_OCR_CACHE_LOCK = threading.Lock()
+
+# Lazily-built pools of Tesseract engines, one pool per language (tesserocr
+# only). PyTessBaseAPI is not thread-safe, so each instance is used by at most
+# one request at a time via Queue.get()/put().
+_TESS_POOLS = {}
+_TESS_POOL_LOCK = threading.Lock()
+
+def _get_pool(lang):
+    """Returns the engine pool for `lang`, creating and filling it on first use."""
+    pool = _TESS_POOLS.get(lang)
+    if pool is None:
+        with _TESS_POOL_LOCK:
+            pool = _TESS_POOLS.get(lang)
+            if pool is None:
+                pool = queue.Queue()
+                psm = _tess_config_int('psm', PSM.SPARSE_TEXT)
+                oem = _tess_config_int('oem', OEM.LSTM_ONLY)
+                for _ in range(KTP_TESS_POOL):
+                    pool.put(tesserocr.PyTessBaseAPI(lang=lang, psm=psm, oem=oem))
+                _TESS_POOLS[lang] = pool
+    return pool
+
+# Dictionary for normalizing commonly misdetected OCR values
+NORMALIZATION_MAPS = {
+    "agama": {
+        "BA": "ISLAM",
+        "BUDHA": "BUDHA",
+        "HINDU": "HINDU",
+        "ISLAM": "ISLAM",
+        "KATOLIK": "KATOLIK",
+        "KONGHUCU": "KONGHUCU",
+        "KRISTEN": "KRISTEN"
+    },
+    "jenis_kelamin": {
+        "LAKI-LAKI": "LAKI-LAKI",
+        "LAKH MU": "LAKI-LAKI", # Typo example
+        "LAKI": "LAKI-LAKI",
+        "PEREMPUAN": "PEREMPUAN",
+        "PEREM PUAN": "PEREMPUAN"
+    },
+    "status_perkawinan": {
+        "KAWIN": "KAWIN",
+        "YAWN A": "KAWIN", # Typo example
+        "BELUM KAWIN": "BELUM KAWIN",
+        "CERAI HIDUP": "CERAI HIDUP",
+        "CERAI MATI": "CERAI MATI"
+    },
+    "kewarganegaraan": {
+        "WNI": "WNI",
+        "WN": "WNI", # Abbreviation or typo
+        "WNA": "WNA"
+    },
+    "pekerjaan": {
+        "MENGURUS RUMAH TANGGA": "MENGURUS RUMAH TANGGA",
+        "MENGUMUS RUMAH TANGGA": "MENGURUS RUMAH TANGGA", # Typo example
+        "KARYAWAN SWASTA": "KARYAWAN SWASTA",
+        "KARYAWAN": "KARYAWAN SWASTA",
+        "PELAJAR/MAHASISWA": "PELAJAR/MAHASISWA",
+        "TNI": "TNI",
+        "POLRI": "POLRI",
+        "PNS": "PNS",
+        "WIRASWASTA": "WIRASWASTA",
+        # Add more job variations if needed
+    },
+    "berlaku_hingga": {
+        "SEUMUR HIDUP": "SEUMUR HIDUP",
+        "UMUR HIDUP": "SEUMUR HIDUP", # Typo example
+        "SF UMUR HIDUP": "SEUMUR HIDUP", # Typo example
+        "BARTAU HINGGA": "SEUMUR HIDUP" # Typo example
+    }
+}
+
+# Per-field alternation of all map keys (longest first so e.g. "BELUM KAWIN"
+# wins over "KAWIN"), for the substring fallback in normalize_value. The common
+# case — the OCR value matching a key exactly — is a plain dict lookup instead.
+_NORM_REGEX = {
+    field: re.compile("|".join(re.escape(k) for k in sorted(mapping, key=len, reverse=True)))
+    for field, mapping in NORMALIZATION_MAPS.items()
+}
+
+# --- Precompiled Regex Patterns ---
+# Compiled once at import time so the per-line extraction loop avoids repeated
+# pattern parsing and re-module cache lookups on every request.
+_RE_NIK = re.compile(r'NIK\s*[: ]*\s*([0-9OIEZSLGAQ\s]{16,})')
+_RE_NAME = re.compile(r'(NAMA(?:\s*LENGKAP)?|TAMA)\s*[: ]*\s*(.*)')
+_RE_NAME_LABEL_ONLY = re.compile(r'NAMA(?:\s*LENGKAP)?\s*[: ]*$')
+_RE_TTL = re.compile(r'(?:TEMPAT/?TGL LAHIR|TEMPAT DAN TGL LAHIR|TEMPAT *TGL LAHIR|TEMPAT/IY AR)\s*[: ]*([A-Z\s]+)[, ]*(\d{2}[-/]\d{2}[-/]\d{4})')
+_RE_TEMPAT = re.compile(r'(?:TEMPAT/?TGL LAHIR|TEMPAT LAHIR|TEMPAT/IY AR)\s*[: ]*([A-Z\s]+?)(?:,|$)')
+_RE_DATE = re.compile(r'(\d{2}[-/]\d{2}[-/]\d{4})')
+_RE_JK = re.compile(r'(?:JENIS KELAMIN|JARAN KETAUAN)\s*[: ]*(LAKI-LAKI|PEREMPUAN|LAKI|PEREMPUAN)')
+# All labelled address sub-fields in one alternation, so the address block is
+# walked once via finditer instead of once per field
+_RE_ADDR_ALL = re.compile(
+    r'(?P<rtrw>(?:RT|R\.T|AT)\s*[: ]*(?P<rt>\d{2,3})\s*(?:RW|R\.W|AW)\s*[: ]*(?P<rw>\d{2,3}))'
+    r'|(?P<kel>(?:KEL/DESA|KELDASA|KAUS)\s*[: ]*(?P<kel_val>[A-Z\s\.]+))'
+    r'|(?P<kec>(?:KECAMATAN|KEAMATAN)\s*[: ]*(?P<kec_val>[A-Z\s\.]+))',
+    re.IGNORECASE)
+_RE_SIMPLE_RT_RW = re.compile(r'(\d{2,3}/\d{2,3})')
+_RE_AGAMA = re.compile(r'AGAMA\s*[: ]*([A-Z\s]+)')
+_RE_STATUS = re.compile(r'(?:STATUS PERKAWINAN|SINTA PERKAMNAN)\s*[: ]*([A-Z\s]+)')
+_RE_PEKERJAAN = re.compile(r'(?:PEKERJAAN|REHENAAAN)\s*[: ]*([A-Z\s\.]+)')
+_RE_KEWARGANEGARAAN = re.compile(r'(?:KEWARGANEGARAAN|#EERGANEYER)\s*[: ]*([A-Z]+)')
+_RE_BERLAKU = re.compile(r'(?:BERLAKU HINGGA|BARTAU HINGGA)\s*[: ]*(SEUMUR HIDUP|\d{2}[-/]\d{2}[-/]\d{4})', re.IGNORECASE)
+_RE_DATE_ONLY = re.compile(r'\d{2}[-/]\d{2}[-/]\d{4}')
+_RE_NON_ALNUM = re.compile(r'[^A-Z0-9\s/.,-]')
+# Translation table for common OCR digit confusions in the NIK (single C-level
+# pass instead of a chain of str.replace calls)
+_NIK_TRANS = str.maketrans({'O': '0', 'I': '1', 'L': '1', 'Z': '2', 'S': '5',
+                            'G': '6', 'Q': '9', 'A': '4', ' ': None})
+_RE_NAME_CLEAN = re.compile(r'[^A-Z\s\.]')
+_RE_LEADING_COLON = re.compile(r'^\s*[:\s]*')
+# Fields that terminate the multi-line address block: one DFA scan per sub-line
+# instead of a Python loop over eight keyword strings
+_ADDR_STOP_RE = re.compile(r'\b(AGAMA|STATUS PERKAWINAN|PEKERJAAN|KEWARGANEGARAAN|BERLAKU HINGGA|JENIS KELAMIN|TEMPAT/TGL LAHIR|NIK|NAMA)\b')
+
+def normalize_value(field, value):
+    """Normalizes extracted values based on a dictionary."""
+    if value is None:
+        return None
+
+    # Pre-clean value before normalization lookup
+    value = value.upper().strip()
+    value = _RE_NON_ALNUM.sub('', value) # Remove common non-alphanumeric characters
+
+    mapping = NORMALIZATION_MAPS.get(field)
+    if mapping is not None:
+        norm_val = mapping.get(value) # Exact match, the common case
+        if norm_val is not None:
+            return norm_val
+        key_match = _NORM_REGEX[field].search(value) # Substring fallback
+        if key_match:
+            return mapping[key_match.group(0)]
+
+    return value.strip() # Return stripped and uppercased value if not in map
+
+# --- Per-field line handlers ---
+# Each handler receives the current (uppercased) line, its index, the full line
+# list and the result dict. It returns True when it has consumed the line so the
+# dispatch loop can stop, or False to let later handlers (or the birth-date
+# fallback) inspect the same line.
+
+def _handle_nama(line, i, lines, extracted_data):
+    # Search for "NAMA", "NAMA LENGKAP", "TAMA" (common typo) followed by optional colon/space and then capture the value.
+    if extracted_data['Nama'] is not None:
+        # Fall through: "TAMA" also matches inside address lines like
+        # "JL. TAMAN SARI", which still need the later handlers
+        return False
+    name_label_match = _RE_NAME.search(line)
+    if name_label_match:
+        name_value = name_label_match.group(2).strip() # Capture everything after the label and optional colon/space
+        if name_value:
+            # Clean the extracted name value
+            extracted_data['Nama'] = _RE_NAME_CLEAN.sub('', name_value).strip()
+        return True
+    # Fallback: If the label is found but the value is on the next line (e.g., "NAMA:\nJOHN DOE")
+    elif _RE_NAME_LABEL_ONLY.search(line) or ("TAMA" in line and line.endswith(':')):
+        if i + 1 < len(lines):
+            name_value = lines[i+1].strip()
+            if name_value:
+                extracted_data['Nama'] = _RE_NAME_CLEAN.sub('', name_value).strip()
+        return True
+    return False
+
+def _handle_ttl(line, i, lines, extracted_data):
+    # Place/Date of Birth on a single labelled line; partial matches are left to
+    # the separate fallback in the main loop.
+    ttl_match = _RE_TTL.search(line)
+    if ttl_match:
+        extracted_data['Tempat_Lahir'] = ttl_match.group(1).strip()
+        extracted_data['Tanggal_Lahir'] = ttl_match.group(2).replace('/', '-').strip()
+        return True
+    return False
+
+def _handle_jk(line, i, lines, extracted_data):
+    if extracted_data['Jenis_Kelamin'] is not None:
+        return False # Let the remaining handlers inspect the line
+    jk_match = _RE_JK.search(line) # 'LAKI'/'PEREMPUAN' without strip
+    if jk_match:
+        extracted_data['Jenis_Kelamin'] = normalize_value("jenis_kelamin", jk_match.group(1))
+        return True
+    return False
+
+def _handle_alamat(line, i, lines, extracted_data):
+    # Address, RT/RW, Kel/Desa, Kecamatan (Multi-line)
+    if extracted_data['Alamat'] is not None:
+        return True
+    # The "ALAMAT" line itself contributes whatever follows the label
+    alamat_lines_buffer = []
+    val = line.split('ALAMAT', 1)[-1].strip()
+    if val.startswith(':'): val = val[1:].strip()
+    if val: alamat_lines_buffer.append(val)
+    # Following lines belong to the address until the next major KTP field
+    alamat_lines_buffer.extend(itertools.takewhile(
+        lambda sub_line: not _ADDR_STOP_RE.search(sub_line), lines[i+1:]))
+
+    full_address_block = " ".join(alamat_lines_buffer).strip()
+
+    # --- Extract RT/RW, Kel/Desa and Kecamatan in one pass ---
+    # A single finditer walks the block once; the matched spans are sliced out
+    # of the address afterwards in one go for a cleaner alamat field
+    consumed_spans = []
+    for addr_match in _RE_ADDR_ALL.finditer(full_address_block):
+        if addr_match.group('rtrw') and extracted_data['RT_RW'] is None:
+            extracted_data['RT_RW'] = f"{addr_match.group('rt')}/{addr_match.group('rw')}"
+        elif addr_match.group('kel') and extracted_data['Kel_Desa'] is None:
+            extracted_data['Kel_Desa'] = addr_match.group('kel_val').strip()
+        elif addr_match.group('kec') and extracted_data['Kecamatan'] is None:
+            extracted_data['Kecamatan'] = addr_match.group('kec_val').strip()
+        else:
+            continue
+        consumed_spans.append(addr_match.span())
+    if consumed_spans:
+        remainder = []
+        prev_end = 0
+        for start, end in consumed_spans:
+            remainder.append(full_address_block[prev_end:start])
+            prev_end = end
+        remainder.append(full_address_block[prev_end:])
+        full_address_block = ''.join(remainder).strip()
+
+    if extracted_data['RT_RW'] is None: # Try simple XX/YYY format anywhere
+        simple_rt_rw_match = _RE_SIMPLE_RT_RW.search(full_address_block)
+        if simple_rt_rw_match:
+            extracted_data['RT_RW'] = simple_rt_rw_match.group(1)
+            full_address_block = (full_address_block[:simple_rt_rw_match.start()]
+                                  + full_address_block[simple_rt_rw_match.end():]).strip()
+
+    # The remaining text in full_address_block should be the main street address
+    extracted_data['Alamat'] = _RE_LEADING_COLON.sub('', full_address_block).strip() # Remove colon or spaces at the beginning
+    return True # Important to avoid double-processing the same line
+
+def _handle_agama(line, i, lines, extracted_data):
+    if extracted_data['Agama'] is None:
+        agama_match = _RE_AGAMA.search(line)
+        if agama_match:
+            extracted_data['Agama'] = normalize_value("agama", agama_match.group(1))
+    return True
+
+def _handle_status(line, i, lines, extracted_data):
+    if extracted_data['Status_Perkawinan'] is None:
+        status_match = _RE_STATUS.search(line)
+        if status_match:
+            extracted_data['Status_Perkawinan'] = normalize_value("status_perkawinan", status_match.group(1))
+    return True
+
+def _handle_pekerjaan(line, i, lines, extracted_data):
+    # More flexible to include "MENGURUS RUMAH TANGGA" or "KARYAWAN SWASTA"
+    if extracted_data['Pekerjaan'] is None:
+        pekerjaan_match = _RE_PEKERJAAN.search(line)
+        if pekerjaan_match:
+            extracted_data['Pekerjaan'] = normalize_value("pekerjaan", pekerjaan_match.group(1))
+    return True
+
+def _handle_kewarganegaraan(line, i, lines, extracted_data):
+    if extracted_data['Kewarganegaraan'] is None:
+        kewarganegaraan_match = _RE_KEWARGANEGARAAN.search(line)
+        if kewarganegaraan_match:
+            extracted_data['Kewarganegaraan'] = normalize_value("kewarganegaraan", kewarganegaraan_match.group(1))
+    return True
+
+def _handle_berlaku(line, i, lines, extracted_data):
+    if extracted_data['Berlaku_Hingga'] is None:
+        berlaku_match = _RE_BERLAKU.search(line)
+        if berlaku_match:
+            extracted_data['Berlaku_Hingga'] = normalize_value("berlaku_hingga", berlaku_match.group(1))
+            if extracted_data['Berlaku_Hingga'] is not None and _RE_DATE_ONLY.match(extracted_data['Berlaku_Hingga']):
+                extracted_data['Berlaku_Hingga'] = extracted_data['Berlaku_Hingga'].replace('/', '-')
+    return True
+
+# Dispatch table: cheap substring pre-checks (C-level `in`) decide which compiled
+# regex/handler to run, instead of running every field regex on every line.
+_FIELD_DISPATCH = [
+    (("NAMA", "TAMA"), _handle_nama),
+    (("TEMPAT", "LAHIR"), _handle_ttl),
+    (("JENIS KELAMIN", "JARAN KETAUAN"), _handle_jk),
+    (("ALAMAT",), _handle_alamat),
+    (("AGAMA",), _handle_agama),
+    (("STATUS PERKAWINAN", "SINTA PERKAMNAN"), _handle_status),
+    (("PEKERJAAN", "REHENAAAN"), _handle_pekerjaan),
+    (("KEWARGANEGARAAN", "#EERGANEYER"), _handle_kewarganegaraan),
+    (("BERLAKU HINGGA", "BARTAU HINGGA"), _handle_berlaku),
+]
+
+# Every extraction target except raw_ocr_text; once all are filled the
+# remaining lines carry nothing new and the loop can stop
+_REQUIRED_FIELDS = ("NIK", "Nama", "Tempat_Lahir", "Tanggal_Lahir",
+                    "Jenis_Kelamin", "Alamat", "RT_RW", "Kel_Desa", "Kecamatan",
+                    "Agama", "Status_Perkawinan", "Pekerjaan", "Kewarganegaraan",
+                    "Berlaku_Hingga")
+
+def extract_ktp_data_from_image(img, lang='ind'):
+    """
+    Performs OCR on a decoded KTP image (BGR ndarray), extracts key data using
+    improved regex, and returns it as a dictionary.
+    """
+    # --- Image Preprocessing for Better OCR Results ---
+    # Downscale oversized uploads (e.g. 12MP phone photos) before OCR; Tesseract
+    # runtime grows with pixel count and a KTP stays readable at ~1600px.
+    h, w = img.shape[:2]
+    scale = KTP_MAX_DIM / max(h, w)
+    if scale < 1.0:
+        img = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+    # Convert to grayscale
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    # Local mean binarization: one integral-image pass, and far more robust to
+    # the glare and shadows of phone photos than a global (Otsu) threshold
+    thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
+                                   cv2.THRESH_BINARY, KTP_ADAPTIVE_BLOCK, KTP_ADAPTIVE_C)
+
+    # Perform OCR straight from the numpy array; a PIL round-trip would copy and
+    # re-encode the whole image for nothing
+    try:
+        if tesserocr is not None:
+            # Borrow a preinitialized in-process engine instead of forking a
+            # tesseract binary per call; returned to the pool when done
+            pool = _get_pool(lang)
+            api = pool.get()
+            try:
+                h, w = thresh.shape[:2]
+                api.SetImageBytes(thresh.tobytes(), w, h, 1, w) # single-channel grayscale
+                raw_text = api.GetUTF8Text()
+            finally:
+                pool.put(api)
+        else:
+            raw_text = pytesseract.image_to_string(thresh, lang=lang, config=KTP_TESS_CONFIG)
+    except pytesseract.TesseractNotFoundError:
+        return {"error": "Tesseract OCR engine not found. Ensure it's installed and its path is correct."}
+    except Exception as e:
+        return {"error": f"An error occurred during OCR: {e}"}
+
+    # --- Data Extraction from Raw Text (Improved Logic) ---
+    # Initialize with None for all fields
+    extracted_data = {
+        "NIK": None,
+        "Nama": None,
+        "Tempat_Lahir": None,
+        "Tanggal_Lahir": None,
+        "Jenis_Kelamin": None,
+        "Alamat": None,
+        "RT_RW": None,
+        "Kel_Desa": None,
+        "Kecamatan": None,
+        "Agama": None,
+        "Status_Perkawinan": None,
+        "Pekerjaan": None,
+        "Kewarganegaraan": None,
+        "Berlaku_Hingga": None,
+        "raw_ocr_text": raw_text
+    }
+
+    # Split text into lines and normalize each line (strip once, not twice)
+    lines = []
+    append = lines.append
+    for raw_line in raw_text.split('\n'):
+        stripped = raw_line.strip()
+        if stripped:
+            append(stripped.upper())
+    # One uppercase pass over the raw text for the global NIK regex; searching the
+    # raw text also catches a NIK that shares its line with other fields
+    full_text_upper = raw_text.upper()
+
+    # --- NIK ---
+    # Search for NIK with more flexible patterns, including common typos
+    # Allow non-digit characters between digits, then clean them
+    nik_match = _RE_NIK.search(full_text_upper)
+    if nik_match:
+        nik_raw_candidate = nik_match.group(1)
+        # Cleaning NIK: map common OCR errors to digits and drop spaces in one pass
+        cleaned_nik = nik_raw_candidate.translate(_NIK_TRANS)
+        # Take only the first 16 digits
+        cleaned_nik = ''.join(filter(str.isdigit, cleaned_nik))[:16]
+        if len(cleaned_nik) == 16:
+            extracted_data['NIK'] = cleaned_nik
+
+    # --- Iterate per line for extraction ---
+    for i, line in enumerate(lines):
+        handled = False
+        for keywords, handler in _FIELD_DISPATCH:
+            if any(keyword in line for keyword in keywords):
+                if handler(line, i, lines, extracted_data):
+                    handled = True
+                    break
+        if handled:
+            # Fields only change on handled lines; stop once everything is filled
+            if all(extracted_data[field] is not None for field in _REQUIRED_FIELDS):
+                break
+        elif extracted_data['Tempat_Lahir'] is None:
+            # Fallback for place/date of birth split across unlabelled lines
+            tempat_match = _RE_TEMPAT.search(line)
+            if tempat_match:
+                extracted_data['Tempat_Lahir'] = tempat_match.group(1).strip()
+            tanggal_match = _RE_DATE.search(line)
+            if tanggal_match:
+                extracted_data['Tanggal_Lahir'] = tanggal_match.group(1).replace('/', '-').strip()
+
+    # --- Return the extracted_data dictionary as populated, without explicit reordering ---
+    return extracted_data
+
+@app.route('/ocr/ktp', methods=['POST'])
+def ocr_ktp():
+    """
+    API endpoint to upload a KTP image and get extracted data.
+    """
+    if 'file' not in request.files:
+        return jsonify({"error": "No 'file' part in the request."}), 400
+
+    file = request.files['file']
+
+    if file.filename == '':
+        return jsonify({"error": "No file selected."}), 400
+
+    if file:
+        file_bytes = file.read()
+        if not file_bytes:
+            return jsonify({"error": "Uploaded file is empty."}), 400
+
+        # Repeat uploads of the same image (retries, batch reprocessing) skip OCR
+        # entirely: hashing the bytes takes a few ms, OCR takes hundreds
+        cache_key = (hashlib.sha256(file_bytes).hexdigest(), 'ind')
+        with _OCR_CACHE_LOCK:
+            cached = _OCR_CACHE.get(cache_key)
+            if cached is not None:
+                _OCR_CACHE.move_to_end(cache_key) # Refresh LRU position
+                return jsonify(cached), 200
+
+        try:
+            # Decode straight from the upload bytes; a tempfile round-trip would
+            # add a full write + read of the image to disk per request
+            img = cv2.imdecode(np.frombuffer(file_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if img is None:
+                return jsonify({"error": "Could not decode image. Ensure it's a valid image format."}), 400
+
+            # Call the KTP data extraction function
+            extracted_data = extract_ktp_data_from_image(img, lang='ind')
+
+            # Check for errors from the data extraction function
+            if "error" in extracted_data and extracted_data["error"]:
+                return jsonify(extracted_data), 500
+
+            # Cache the successful result, evicting the least recently used entry
+            with _OCR_CACHE_LOCK:
+                _OCR_CACHE[cache_key] = extracted_data
+                if len(_OCR_CACHE) > KTP_CACHE_SIZE:
+                    _OCR_CACHE.popitem(last=False)
+
+            return jsonify(extracted_data), 200
+        except Exception as e:
+            # Handle unexpected errors during the process
+            return jsonify({"error": f"Internal server error: {str(e)}"}), 500
+    return jsonify({"error": "Unknown error."}), 500
+
+@app.route('/')
+def home():
+    """
+    Simple home page to check if the API is running.
+    """
+    return "KTP OCR API is running. Send a POST request to /ocr/ktp with a 'file' parameter containing the KTP image."
+
+def _warmup():
+    """
+    Front-loads one-time costs at import so the first request doesn't pay them:
+    builds the Tesseract engine pool (LSTM model load) and exercises every
+    compiled pattern once. Combined with gunicorn --preload this all happens
+    once in the master process. Disable with KTP_WARMUP=0.
+    """
+    if tesserocr is not None:
+        dummy = np.full((32, 32), 255, np.uint8)
+        pool = _get_pool('ind')
+        api = pool.get()
+        try:
+            api.SetImageBytes(dummy.tobytes(), 32, 32, 1, 32)
+            api.GetUTF8Text()
+        finally:
+            pool.put(api)
+    for rx in (_RE_NIK, _RE_NAME, _RE_NAME_LABEL_ONLY, _RE_TTL, _RE_TEMPAT,
+               _RE_DATE, _RE_JK, _RE_ADDR_ALL, _RE_SIMPLE_RT_RW, _RE_AGAMA,
+               _RE_STATUS, _RE_PEKERJAAN, _RE_KEWARGANEGARAAN, _RE_BERLAKU,
+               _RE_DATE_ONLY, _RE_NON_ALNUM, _RE_NAME_CLEAN, _RE_LEADING_COLON,
+               _ADDR_STOP_RE):
+        rx.search("WARMUP")
+
+if os.environ.get('KTP_WARMUP', '1') == '1':
+    _warmup()
+
+if __name__ == '__main__' and os.environ.get('KTP_DEV'):
+    # Development server only (single-threaded, with reloader). In production
+    # serve via `gunicorn -w N --preload wsgi:app` instead; see wsgi.py.
+    app.run(debug=True, host='0.0.0.0', port=5000)
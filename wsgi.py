@@ -0,0 +1,17 @@
+"""
+WSGI entry point for production serving.
+
+Run behind gunicorn with --preload so the Tesseract language data and the
+compiled regex patterns are initialized once in the master process and shared
+with the workers via copy-on-write:
+
+    gunicorn -w $(nproc) --preload --threads 1 wsgi:app
+"""
+import app as ktp_app
+
+app = ktp_app.app
+
+# Build the Tesseract engine pool in the preloaded master so every worker
+# inherits the loaded language data instead of paying the load cost itself
+if ktp_app.tesserocr is not None:
+    ktp_app._get_pool('ind')